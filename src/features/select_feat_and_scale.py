@@ -302,12 +302,16 @@ def scale_dataframes(
         Test dataframe.
 
     scaler : sklearn scaler object
-        Scaler object to scale the dataframes.
+        Scaler object to scale the dataframes. If None, the features are
+        returned unscaled.
 
     Returns
     -------
-    df_train, df_val, df_test : pandas dataframes
-        Scaled train/val/test dataframes.
+    x_train, x_val, x_test : numpy arrays
+        Scaled train/val/test feature arrays.
+
+    y_train, y_val, y_test : numpy arrays
+        Train/val/test arrays of the col_y_labels columns.
 
 
 
@@ -318,9 +322,16 @@ def scale_dataframes(
     #     col_y_labels in df_train.columns
     # ), "df_train must not have col_y_labels in the columns"
 
-    x_train = scaler.transform(df_val.drop(col_drop_list, axis=1))
-    x_val = scaler.transform(df_val.drop(col_drop_list, axis=1))
-    x_test = scaler.transform(df_test.drop(col_drop_list, axis=1))
+    x_train = df_train.drop(col_drop_list, axis=1)
+    x_val = df_val.drop(col_drop_list, axis=1)
+    x_test = df_test.drop(col_drop_list, axis=1)
+
+    if scaler is not None:
+        x_train = scaler.transform(x_train)
+        x_val = scaler.transform(x_val)
+        x_test = scaler.transform(x_test)
+    else:
+        x_train, x_val, x_test = x_train.to_numpy(), x_val.to_numpy(), x_test.to_numpy()
 
     # save the x_train, x_val, and x_test arrays as .npy files
     if save_data:
@@ -339,7 +350,7 @@ def scale_dataframes(
         np.save(folder_save_path / "y_val.npy", y_val)
         np.save(folder_save_path / "y_test.npy", y_test)
 
-    return df_train, df_val, df_test, y_train, y_val, y_test
+    return x_train, x_val, x_test, y_train, y_val, y_test
 
 
 def main(path_data_folder):
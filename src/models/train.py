@@ -26,6 +26,7 @@ from src.models.utils import (
     get_classifier_and_params,
     get_model_metrics_df,
     feat_selection_binary_classification,
+    get_column_positions,
 )
 from src.models.random_search_setup import general_params
 from src.models.classifiers import (
@@ -108,6 +109,7 @@ def kfold_cv(
     feat_col_list=None,
     early_stopping_rounds=None,
     check_feat_importance=False,
+    return_curves=True,
 ):
     print("feat_select_method: ", feat_selection)
     print("k_folds in kfold_cv: ", n_splits)
@@ -118,6 +120,13 @@ def kfold_cv(
     np.random.seed(sampler_seed)  # fix random seeds
     random.seed(sampler_seed)
 
+    # get the feature and label arrays once, and index into them for each fold
+    df_x = df.drop(meta_label_cols + [y_label_col], axis=1)
+    x_cols = df_x.columns
+    x_all = np.ascontiguousarray(df_x.values, dtype=np.float32)  # so each fold's rows are too
+    y_all = df[y_label_col].to_numpy(dtype=np.int8)  # binary labels
+    feat_col_index = None  # positions of the feat_col_list columns in x_cols
+
     # perform stratified k-fold cross validation using the grouping of the y-label and another column
     if (
         stratification_grouping_col is not None
@@ -125,6 +134,11 @@ def kfold_cv(
     ):
         df_strat = df[[stratification_grouping_col, y_label_col]].drop_duplicates()
 
+        # encode the groups as integer codes once, so that each fold can select
+        # its rows with a boolean lookup table instead of an isin scan
+        group_uniques = pd.Index(df_strat[stratification_grouping_col].unique())
+        group_codes = group_uniques.get_indexer(df[stratification_grouping_col])
+
         skfolds = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=42)
         # use clone to do a deep copy of model without copying attached data
         # https://scikit-learn.org/stable/modules/generated/sklearn.base.clone.html
@@ -146,30 +160,34 @@ def kfold_cv(
             ].values
 
             # train
-            df_train = df[df[stratification_grouping_col].isin(train_strat_vals)]
-            df_train = shuffle(df_train, random_state=42+i) # shuffle rows
-            df_train = df_train.reset_index(drop=True)
-            unique_train_group = list(df_train[stratification_grouping_col].unique())
-            y_train = df_train[y_label_col].values.astype(int)
-            df_train = df_train.drop(meta_label_cols + [y_label_col], axis=1)
-            x_train_cols = df_train.columns
+            train_group_lut = np.zeros(len(group_uniques), dtype=bool)
+            train_group_lut[group_uniques.get_indexer(pd.unique(train_strat_vals))] = True
+            train_index = np.flatnonzero(train_group_lut[group_codes])
+            train_index = shuffle(train_index, random_state=42+i) # shuffle rows
+            unique_train_group = list(
+                pd.unique(df[stratification_grouping_col].values[train_index])
+            )
+            y_train = y_all[train_index]
+            x_train_cols = x_cols
 
             # save x_train_cols to csv file, for debugging
             # Path("x_train_cols.csv").write_text(
             #     "\n".join(x_train_cols)
             # )
 
-            x_train = df_train.values
+            x_train = x_all[train_index]
 
             # test
-            df_test = df[df[stratification_grouping_col].isin(test_strat_vals)]
-            df_test = shuffle(df_test, random_state=42+i) # shuffle rows
-            df_test = df_test.reset_index(drop=True)
-            unique_test_group = list(df_test[stratification_grouping_col].unique())
-            y_test = df_test[y_label_col].values.astype(int)
-            df_test = df_test.drop(meta_label_cols + [y_label_col], axis=1)
-            x_test_cols = df_test.columns
-            x_test = df_test.values
+            test_group_lut = np.zeros(len(group_uniques), dtype=bool)
+            test_group_lut[group_uniques.get_indexer(pd.unique(test_strat_vals))] = True
+            test_index = np.flatnonzero(test_group_lut[group_codes])
+            test_index = shuffle(test_index, random_state=42+i) # shuffle rows
+            unique_test_group = list(
+                pd.unique(df[stratification_grouping_col].values[test_index])
+            )
+            y_test = y_all[test_index]
+            x_test_cols = x_cols
+            x_test = x_all[test_index]
 
             # over-sample the data
             x_train, y_train = under_over_sampler(
@@ -264,6 +282,9 @@ def kfold_cv(
 
             elif feat_selection is not None and feat_col_list is not None:
                 print("using already selected features")
+                # the feature columns are the same for every fold, so their positions are found once
+                if feat_col_index is None:
+                    feat_col_index = get_column_positions(x_cols, feat_col_list)
                 x_train, x_test, feat_col_list = feat_selection_binary_classification(
                     x_train,
                     y_train,
@@ -272,6 +293,7 @@ def kfold_cv(
                     y_test,
                     x_test_cols,
                     feat_col_list=feat_col_list,
+                    col_index=feat_col_index,
                 )
             else:
                 print("not using feature selection")
@@ -298,7 +320,9 @@ def kfold_cv(
 
             # calculate the scores for each individual model train in the cross validation
             # save as a dictionary: "ind_score_dict"
-            ind_score_dict = calculate_scores(clone_clf, x_test, y_test)
+            ind_score_dict = calculate_scores(
+                clone_clf, x_test, y_test, return_curves=return_curves
+            )
             ind_score_dict["unique_grouping"] = {
                 "unique_train_group": unique_train_group,
                 "unique_test_group": unique_test_group,
@@ -321,29 +345,22 @@ def kfold_cv(
         skfolds = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=42)
 
         for i, (train_index, test_index) in enumerate(
-            skfolds.split(df, df[[y_label_col]])
+            skfolds.split(x_all, y_all)
         ):
             clone_clf = clone(clf)
 
-            df_train = df.iloc[train_index]
-            df_train = shuffle(df_train, random_state=42+i)
-            df_train = df_train.reset_index(drop=True)
-
-            df_test = df.iloc[test_index]
-            df_test = shuffle(df_test, random_state=42+i)
-            df_test = df_test.reset_index(drop=True)
+            train_index = shuffle(train_index, random_state=42+i)
+            test_index = shuffle(test_index, random_state=42+i)
 
-            y_train = df_train[y_label_col].values.astype(int)
-            df_train = df_train.drop(meta_label_cols + [y_label_col], axis=1)
+            y_train = y_all[train_index]
             unique_train_group = None  # no unique grouping for this case
-            x_train_cols = df_train.columns
-            x_train = df_train.values
+            x_train_cols = x_cols
+            x_train = x_all[train_index]
 
-            y_test = df_test[y_label_col].values.astype(int)
-            df_test = df_test.drop(meta_label_cols + [y_label_col], axis=1)
+            y_test = y_all[test_index]
             unique_test_group = None  # no unique grouping for this case
-            x_test_cols = df_test.columns
-            x_test = df_test.values
+            x_test_cols = x_cols
+            x_test = x_all[test_index]
 
             # over-sample the data
             x_train, y_train = under_over_sampler(
@@ -435,6 +452,9 @@ def kfold_cv(
 
             elif feat_selection is not None and feat_col_list is not None:
                 print("using already selected features")
+                # the feature columns are the same for every fold, so their positions are found once
+                if feat_col_index is None:
+                    feat_col_index = get_column_positions(x_cols, feat_col_list)
                 x_train, x_test, feat_col_list = feat_selection_binary_classification(
                     x_train,
                     y_train,
@@ -443,6 +463,7 @@ def kfold_cv(
                     y_test,
                     x_test_cols,
                     feat_col_list=feat_col_list,
+                    col_index=feat_col_index,
                 )
             else:
                 print("not using feature selection")
@@ -465,7 +486,9 @@ def kfold_cv(
 
             # calculate the scores for each individual model train in the cross validation
             # save as a dictionary: "ind_score_dict"
-            ind_score_dict = calculate_scores(clone_clf, x_test, y_test)
+            ind_score_dict = calculate_scores(
+                clone_clf, x_test, y_test, return_curves=return_curves
+            )
             ind_score_dict["unique_grouping"] = {
                 "unique_train_group": unique_train_group,
                 "unique_test_group": unique_test_group,
@@ -503,16 +526,23 @@ def train_single_model(
     feat_col_list=None,
     general_params=general_params,
     params_clf=None,
+    params_dict_train_setup=None,
     save_model=False,
     model_save_name=None,
     model_save_path=None,
     dataset_name=None,
     check_feat_importance=False,
+    return_curves=True,
 ):
-    # generate the list of parameters to sample over
-    params_dict_train_setup = list(
-        ParameterSampler(general_params, n_iter=1, random_state=sample_seed)
-    )[0]
+    # generate the list of parameters to sample over, unless the caller
+    # has already sampled the training setup (e.g. from a ParameterSampler
+    # iterated once for a whole search)
+    if params_dict_train_setup is None:
+        params_dict_train_setup = list(
+            ParameterSampler(general_params, n_iter=1, random_state=sample_seed)
+        )[0]
+    else:
+        params_dict_train_setup = dict(params_dict_train_setup)
 
     oversamp_method = params_dict_train_setup["oversamp_method"]
     undersamp_method = params_dict_train_setup["undersamp_method"]
@@ -626,6 +656,7 @@ def train_single_model(
         feat_col_list=feat_col_list,
         early_stopping_rounds=early_stopping_rounds,
         check_feat_importance=check_feat_importance,
+        return_curves=return_curves,
     )
 
     # added additional parameters to the training setup dictionary
@@ -718,6 +749,7 @@ def random_search_runner(
                 general_params=general_params,
                 params_clf=None,
                 dataset_name=dataset_name,
+                return_curves=False,  # the curves are not plotted in the random search
             )
 
             # train setup params
@@ -796,14 +828,13 @@ def set_directories(args):
     scratch_path = Path.home() / "scratch"
     if scratch_path.exists():
         print("Assume on HPC")
-
-        path_save_dir = scratch_path / "feat-store/models" / args.save_dir_name
-        Path(path_save_dir / "setup_files").mkdir(parents=True, exist_ok=True)
-
+        root_save_dir = scratch_path / "feat-store"
     else:
         print("Assume on local compute")
-        path_save_dir = proj_dir / "models" / save_dir_name
-        Path(path_save_dir / "setup_files").mkdir(parents=True, exist_ok=True)
+        root_save_dir = proj_dir
+
+    path_save_dir = root_save_dir / "models" / save_dir_name
+    Path(path_save_dir / "setup_files").mkdir(parents=True, exist_ok=True)
 
     path_processed_dir = (
         path_data_dir / "processed" / args.dataset / args.processed_dir_name
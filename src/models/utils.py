@@ -3,11 +3,12 @@ Utility functions used in the random search training.
 """
 
 from sklearn.model_selection import ParameterSampler
-from imblearn.over_sampling import RandomOverSampler
-from imblearn.under_sampling import RandomUnderSampler
 from imblearn.combine import SMOTEENN, SMOTETomek
 from imblearn.over_sampling import SMOTE, ADASYN, BorderlineSMOTE, KMeansSMOTE, SVMSMOTE
+from imblearn.under_sampling import EditedNearestNeighbours, TomekLinks
+from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
+from functools import partial
 import numpy as np
 import pandas as pd
 
@@ -35,130 +36,240 @@ from src.models.classifiers import (
 
 from sklearn.metrics import (
     roc_auc_score,
-    auc,
+    average_precision_score,
     precision_recall_curve,
     precision_score,
     recall_score,
     f1_score,
     roc_curve,
-    accuracy_score,
     matthews_corrcoef,
     confusion_matrix,
 )
 
 
-def under_over_sampler(x, y, method=None, ratio=0.5):
+def _nearest_neighbors(n_neighbors, nn_algorithm="auto", n_jobs=-1):
     """
-    Returns an undersampled or oversampled data set. Implemented using imbalanced-learn package.
-    ['random_over','random_under','random_under_bootstrap','smote', 'adasyn']
+    NearestNeighbors estimator for the SMOTE variants. n_neighbors includes the
+    sample itself, so it is one more than the k_neighbors/m_neighbors int it replaces.
     """
+    return NearestNeighbors(n_neighbors=n_neighbors, algorithm=nn_algorithm, n_jobs=n_jobs)
 
-    if method == None:
-        return x, y
 
-    # oversample methods: https://imbalanced-learn.readthedocs.io/en/stable/over_sampling.html
-    elif method == "random_over":
-        # print('before:',sorted(Counter(y).items()))
-        ros = RandomOverSampler(sampling_strategy=ratio, random_state=0)
-        x_resampled, y_resampled = ros.fit_resample(x, y)
-        # print('after:',sorted(Counter(y_resampled).items()))
-        return x_resampled, y_resampled
-
-    elif method == "random_under":
-        rus = RandomUnderSampler(sampling_strategy=ratio, random_state=0)
-        x_resampled, y_resampled = rus.fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "random_under_bootstrap":
-        rus = RandomUnderSampler(
-            sampling_strategy=ratio, random_state=0, replacement=True
+def _binary_class_counts(y, ratio):
+    """
+    Classes in y and the number of samples in each, after checking that the
+    ratio can be used with them (as done in imbalanced-learn)
+    """
+    if not 0 < ratio <= 1:
+        raise ValueError(
+            f"When 'sampling_strategy' is a float, it should be in the range (0, 1]. Got {ratio} instead."
+        )
+    classes, counts = np.unique(y, return_counts=True)
+    if len(classes) < 2:
+        raise ValueError(
+            f"The target 'y' needs to have more than 1 class. Got {len(classes)} class instead"
         )
-        x_resampled, y_resampled = rus.fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "smote":
-        x_resampled, y_resampled = SMOTE(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "borderline_smote":
-        x_resampled, y_resampled = BorderlineSMOTE(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "kmeans_smote":
-        x_resampled, y_resampled = KMeansSMOTE(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "svm_smote":
-        x_resampled, y_resampled = SVMSMOTE(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "smote_enn":
-        x_resampled, y_resampled = SMOTEENN(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "smote_tomek":
-        x_resampled, y_resampled = SMOTETomek(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
-
-    elif method == "adasyn":
-        x_resampled, y_resampled = ADASYN(
-            sampling_strategy=ratio, random_state=0
-        ).fit_resample(x, y)
-        return x_resampled, y_resampled
+    if len(classes) > 2:
+        raise ValueError(
+            '"sampling_strategy" can be a float only when the type of target is binary.'
+        )
+    return classes, counts
 
-    else:
-        return x, y
 
+def _random_over_sample(x, y, ratio):
+    """
+    Randomly repeat minority class samples until there are ratio * n_majority of them.
+    The same samples, in the same order, as imbalanced-learn's
+    RandomOverSampler(sampling_strategy=ratio, random_state=0).
+    """
+    y = np.asarray(y)
+    classes, counts = _binary_class_counts(y, ratio)
+    rng = np.random.RandomState(0)
+
+    i_majority = np.argmax(counts)
+    sample_indices = [np.arange(len(y))]
+    for i, class_label in enumerate(classes):
+        if i == i_majority:
+            continue
+        n_new = int(counts[i_majority] * ratio - counts[i])
+        if n_new <= 0:
+            raise ValueError(
+                "The specified ratio required to remove samples from the minority class "
+                "while trying to generate new samples. Please increase the ratio."
+            )
+        sample_indices.append(
+            rng.choice(np.flatnonzero(y == class_label), size=n_new, replace=True)
+        )
+
+    sample_indices = np.concatenate(sample_indices)
+    return x[sample_indices], y[sample_indices]
 
-def get_classifier_and_params(classifier_string):
-    if classifier_string == "rf":
-        return rf_classifier, rf_params
 
-    elif classifier_string == "xgb":
-        return xgb_classifier, xgb_params
+def _random_under_sample(x, y, ratio, replacement=False):
+    """
+    Randomly select majority class samples so that there are n_minority / ratio of them.
+    The same samples, in the same (class) order, as imbalanced-learn's
+    RandomUnderSampler(sampling_strategy=ratio, random_state=0, replacement=replacement).
+    """
+    y = np.asarray(y)
+    classes, counts = _binary_class_counts(y, ratio)
+    rng = np.random.RandomState(0)
+
+    i_minority = np.argmin(counts)
+    sample_indices = []
+    for i, class_label in enumerate(classes):
+        class_indices = np.flatnonzero(y == class_label)
+        if i != i_minority:
+            n_keep = int(counts[i_minority] / ratio)
+            if n_keep > counts[i]:
+                raise ValueError(
+                    "The specified ratio required to generate new sample in the majority class "
+                    "while trying to remove samples. Please increase the ratio."
+                )
+            class_indices = class_indices[rng.choice(counts[i], size=n_keep, replace=replacement)]
+        sample_indices.append(class_indices)
+
+    sample_indices = np.concatenate(sample_indices)
+    return x[sample_indices], y[sample_indices]
+
+
+# the random over/under samplers only pick rows, so they are done directly with numpy
+_RANDOM_SAMPLERS = {
+    "random_over": _random_over_sample,
+    "random_under": _random_under_sample,
+    "random_under_bootstrap": partial(_random_under_sample, replacement=True),
+}
+
+# builders for each of the other samplers in under_over_sampler, called with the sampling ratio, n_jobs,
+# and a function giving a NearestNeighbors estimator for a number of neighbors.
+# oversample methods: https://imbalanced-learn.readthedocs.io/en/stable/over_sampling.html
+# the inner SMOTE and cleaning samplers of SMOTEENN/SMOTETomek are built explicitly so that
+# they get n_jobs (they are otherwise created with sampling_strategy=ratio / "all" by imbalanced-learn)
+_SAMPLERS = {
+    "smote": lambda ratio, n_jobs, nn: SMOTE(
+        sampling_strategy=ratio, random_state=0, k_neighbors=nn(6)
+    ),
+    "borderline_smote": lambda ratio, n_jobs, nn: BorderlineSMOTE(
+        sampling_strategy=ratio, random_state=0, k_neighbors=nn(6), m_neighbors=nn(11)
+    ),
+    "kmeans_smote": lambda ratio, n_jobs, nn: KMeansSMOTE(
+        sampling_strategy=ratio, random_state=0, k_neighbors=nn(3)
+    ),
+    "svm_smote": lambda ratio, n_jobs, nn: SVMSMOTE(
+        sampling_strategy=ratio, random_state=0, k_neighbors=nn(6), m_neighbors=nn(11)
+    ),
+    "smote_enn": lambda ratio, n_jobs, nn: SMOTEENN(
+        sampling_strategy=ratio,
+        random_state=0,
+        smote=SMOTE(sampling_strategy=ratio, random_state=0, k_neighbors=nn(6)),
+        enn=EditedNearestNeighbours(sampling_strategy="all", n_jobs=n_jobs),
+    ),
+    "smote_tomek": lambda ratio, n_jobs, nn: SMOTETomek(
+        sampling_strategy=ratio,
+        random_state=0,
+        smote=SMOTE(sampling_strategy=ratio, random_state=0, k_neighbors=nn(6)),
+        tomek=TomekLinks(sampling_strategy="all", n_jobs=n_jobs),
+    ),
+    "adasyn": lambda ratio, n_jobs, nn: ADASYN(
+        sampling_strategy=ratio, random_state=0, n_neighbors=nn(6)
+    ),
+}
+
+
+def under_over_sampler(x, y, method=None, ratio=0.5, n_jobs=-1, nn_algorithm="auto"):
+    """
+    Returns an undersampled or oversampled data set. Implemented using imbalanced-learn package,
+    except for the random over/under sampling, which is done with numpy.
+    ['random_over','random_under','random_under_bootstrap','smote', 'adasyn']
 
-    elif classifier_string == "knn":
-        return knn_classifier, knn_params
+    The nearest neighbor searches in the SMOTE/ADASYN variants are run with n_jobs
+    and the nn_algorithm (e.g. "kd_tree") passed to sklearn's NearestNeighbors.
+    The number of neighbors used are the imbalanced-learn defaults.
+    A method of None, or one not in _RANDOM_SAMPLERS/_SAMPLERS, returns x and y unchanged.
+    """
 
-    elif classifier_string == "lr":
-        return lr_classifier, lr_params
+    if method not in _RANDOM_SAMPLERS and method not in _SAMPLERS:
+        return x, y
 
-    elif classifier_string == "sgd":
-        return sgd_classifier, sgd_params
+    # C-contiguous float32 rows for the nearest neighbor distance computations
+    x = np.ascontiguousarray(x, dtype=np.float32)
 
-    elif classifier_string == "ridge":
-        return ridge_classifier, ridge_params
+    if method in _RANDOM_SAMPLERS:
+        return _RANDOM_SAMPLERS[method](x, y, ratio)
 
-    elif classifier_string == "svm":
-        return svm_classifier, svm_params
+    build_sampler = _SAMPLERS[method]
+    nn = partial(_nearest_neighbors, nn_algorithm=nn_algorithm, n_jobs=n_jobs)
+    x_resampled, y_resampled = build_sampler(ratio, n_jobs, nn).fit_resample(x, y)
+    return x_resampled, y_resampled
 
-    elif classifier_string == "nb":
-        return nb_classifier, nb_params
 
-    else:
+# classifier function and its random search parameters, for each classifier string
+_CLASSIFIERS = {
+    "rf": (rf_classifier, rf_params),
+    "xgb": (xgb_classifier, xgb_params),
+    "knn": (knn_classifier, knn_params),
+    "lr": (lr_classifier, lr_params),
+    "sgd": (sgd_classifier, sgd_params),
+    "ridge": (ridge_classifier, ridge_params),
+    "svm": (svm_classifier, svm_params),
+    "nb": (nb_classifier, nb_params),
+}
+
+
+def get_classifier_and_params(classifier_string):
+    try:
+        return _CLASSIFIERS[classifier_string]
+    except KeyError:
         raise ValueError("Classifier string not recognized")
 
 
+def get_column_positions(cols, feat_col_list):
+    """
+    Integer positions of the feat_col_list columns in cols, so that the
+    features can be selected directly from the numpy arrays
+    """
+    idx = pd.Index(cols).get_indexer(feat_col_list)
+    if (idx < 0).any():
+        missing = [c for c, i in zip(feat_col_list, idx) if i < 0]
+        raise KeyError(f"{missing} not in the feature columns")
+    return idx
+
+
+_tsfresh_select_features = None
+
+
+def _get_tsfresh_select_features():
+    """
+    Import tsfresh's select_features the first time it is needed, as tsfresh
+    is a heavy package, and keep a reference to it for the later calls
+    """
+    global _tsfresh_select_features
+    if _tsfresh_select_features is None:
+        from tsfresh import select_features
+
+        _tsfresh_select_features = select_features
+    return _tsfresh_select_features
+
+
 def feat_selection_binary_classification(
-    x_train, y_train, x_train_cols, x_test, y_test, x_test_cols, feat_col_list=None
+    x_train,
+    y_train,
+    x_train_cols,
+    x_test,
+    y_test,
+    x_test_cols,
+    feat_col_list=None,
+    col_index=None,
 ):
+    """
+    Select the features with tsfresh, if feat_col_list is None, otherwise select the
+    feat_col_list columns. col_index, from get_column_positions, can be given to reuse
+    the positions of the feat_col_list columns (in both x_train and x_test) between calls.
+    """
     if feat_col_list is None:
-        from tsfresh import (
-            select_features,
-        )  # import in loop because it is a heavy package
+        select_features = _get_tsfresh_select_features()
 
+        # tsfresh needs a dataframe, with the column names, to select the features
         x_train = select_features(
             pd.DataFrame(x_train, columns=x_train_cols),
             y_train,
@@ -171,46 +282,60 @@ def feat_selection_binary_classification(
         feat_col_list = list(x_train.columns)
 
         x_train = x_train.values
-        x_test = pd.DataFrame(x_test, columns=x_test_cols)[feat_col_list].values
+        x_test = x_test[:, get_column_positions(x_test_cols, feat_col_list)]
+
+    elif col_index is not None:
+        x_train = x_train[:, col_index]
+        x_test = x_test[:, col_index]
 
     else:
-        x_train = pd.DataFrame(x_train, columns=x_train_cols)[feat_col_list].values
-        x_test = pd.DataFrame(x_test, columns=x_test_cols)[feat_col_list].values
+        x_train = x_train[:, get_column_positions(x_train_cols, feat_col_list)]
+        x_test = x_test[:, get_column_positions(x_test_cols, feat_col_list)]
 
     return x_train, x_test, feat_col_list
 
 
-def calculate_scores(
-    clf,
-    x_test,
+def calculate_scores_from_scores(
     y_test,
+    y_pred,
+    y_scores,
+    y_proba=None,
+    return_curves=True,
 ):
-    """Helper function for calculating a bunch of scores"""
-
-    y_pred = clf.predict(x_test)
+    """Calculate a bunch of scores from a model's predictions and scores on x_test
 
-    # need decision function or probability
-    # should probably remove the try-except at a later date
-    try:
-        y_scores = clf.decision_function(x_test)
-    except:
-        y_scores = clf.predict_proba(x_test)[:, 1]
+    y_pred are the predicted labels and y_scores the decision function values, or the
+    probabilities of the positive class. y_proba, the probabilities of the positive class,
+    are used for the tuned threshold; if not given, the tuned values are all 0.
 
-    n_thresholds = len(np.unique(y_scores))
+    The ROC curve (fpr, tpr, roc_thresholds) is only used for plotting, so it is
+    not computed when return_curves is False and those entries are None.
+    """
 
-    n_correct = sum(y_pred == y_test)
+    # number of distinct scores, counted from a single sort
+    # (np.unique would also build the array of unique values)
+    sorted_scores = np.sort(y_scores)
+    n_thresholds = int(sorted_scores.size > 0) + np.count_nonzero(np.diff(sorted_scores))
 
-    # calculate the percent accuracy
-    accuracy_result = accuracy_score(y_test, y_pred)
+    # calculate the percent accuracy, from a single comparison
+    is_correct = np.asarray(y_pred) == np.asarray(y_test)
+    n_correct = int(np.count_nonzero(is_correct))
+    accuracy_result = n_correct / is_correct.size
 
     # need to use decision scores, or probabilities, in roc_score
+    # the pr curve is always needed for the threshold tuning below
     precisions, recalls, pr_thresholds = precision_recall_curve(y_test, y_scores)
-    fpr, tpr, roc_thresholds = roc_curve(y_test, y_scores)
+    if return_curves:
+        fpr, tpr, roc_thresholds = roc_curve(y_test, y_scores)
+    else:
+        fpr, tpr, roc_thresholds = None, None, None
 
     # calculate the precision recall curve and roc_auc curve
     # when to use ROC vs. precision-recall curves, Jason Brownlee http://bit.ly/38vEgnW
     # https://stats.stackexchange.com/questions/113326/what-is-a-good-auc-for-a-precision-recall-curve
-    prauc_result = auc(recalls, precisions)
+    # the PR AUC is the average precision, as the trapezoidal auc(recalls, precisions)
+    # linearly interpolates the PR curve and is too optimistic
+    prauc_result = average_precision_score(y_test, y_scores)
     rocauc_result = roc_auc_score(y_test, y_scores)
 
     # calculate precision, recall, f1 scores
@@ -226,11 +351,13 @@ def calculate_scores(
     # this should only be used for evaluating final models to avoid
     # any accidental overfitting to the testing data
     try:
+        if y_proba is None:
+            raise ValueError("No probabilities to apply the tuned threshold to")
         f1_scores = (2 * precisions * recalls) / (precisions + recalls)
         i = np.argmax(f1_scores)
         f1_threshold_tuned = f1_scores[i]
         threshold_tuned = pr_thresholds[i]
-        y_pred_tuned = (clf.predict_proba(x_test)[:, 1] >= threshold_tuned).astype(bool)
+        y_pred_tuned = (y_proba >= threshold_tuned).astype(bool)
         tn_t, fp_t, fn_t, tp_t = confusion_matrix(y_test, y_pred_tuned).ravel()
     except:
         f1_threshold_tuned = 0
@@ -264,6 +391,48 @@ def calculate_scores(
     return scores
 
 
+
+def calculate_scores(
+    clf,
+    x_test,
+    y_test,
+    return_curves=True,
+):
+    """Helper function for calculating a bunch of scores
+
+    The model is only run once on x_test, and the scores are then
+    calculated with calculate_scores_from_scores.
+    """
+
+    # need decision function or probability
+    # should probably remove the try-except at a later date
+    # the predictions are made from the scores in the same way as clf.predict
+    # (positive decision value, or most probable class) so the model is only run once
+    y_proba = None
+    try:
+        y_scores = clf.decision_function(x_test)
+        y_pred = clf.classes_[(y_scores > 0).astype(int)]
+    except:
+        y_proba = clf.predict_proba(x_test)
+        y_scores = y_proba[:, 1]
+        y_pred = clf.classes_[np.argmax(y_proba, axis=1)]
+
+    # the tuned threshold is applied to the probabilities, which not all models have
+    if y_proba is None:
+        try:
+            y_proba = clf.predict_proba(x_test)
+        except:
+            pass
+
+    return calculate_scores_from_scores(
+        y_test,
+        y_pred,
+        y_scores,
+        y_proba=None if y_proba is None else y_proba[:, 1],
+        return_curves=return_curves,
+    )
+
+
 def collate_scores_binary_classification(scores_list):
     """
     Collate the scores from the k-fold cross-validation
@@ -308,19 +477,21 @@ def collate_scores_binary_classification(scores_list):
             ind_score_dict["confusion_matrix_threshold_tuned"]
         )
 
+    # the curves are a different length for each fold, so they are kept as lists of arrays
+    # the per-fold scores are float arrays so that they can be reduced directly
     result_dict = {
-        "precisions_array": np.array(precisions_list, dtype=object),
-        "recalls_array": np.array(recalls_list, dtype=object),
-        "precision_score_array": np.array(precision_score_list, dtype=object),
-        "recall_score_array": np.array(recall_score_list, dtype=object),
-        "fpr_array": np.array(fpr_list, dtype=object),
-        "tpr_array": np.array(tpr_list, dtype=object),
-        "prauc_array": np.array(prauc_list, dtype=object),
-        "rocauc_array": np.array(rocauc_list, dtype=object),
-        "f1_score_array": np.array(f1_list, dtype=object),
-        "mcc_array": np.array(mcc_list, dtype=object),
+        "precisions_array": precisions_list,
+        "recalls_array": recalls_list,
+        "precision_score_array": np.asarray(precision_score_list, dtype=np.float64),
+        "recall_score_array": np.asarray(recall_score_list, dtype=np.float64),
+        "fpr_array": fpr_list,
+        "tpr_array": tpr_list,
+        "prauc_array": np.asarray(prauc_list, dtype=np.float64),
+        "rocauc_array": np.asarray(rocauc_list, dtype=np.float64),
+        "f1_score_array": np.asarray(f1_list, dtype=np.float64),
+        "mcc_array": np.asarray(mcc_list, dtype=np.float64),
         "n_thresholds_array": np.array(n_thresholds_list, dtype=int),
-        "accuracy_array": np.array(accuracy_list, dtype=object),
+        "accuracy_array": np.asarray(accuracy_list, dtype=np.float64),
         "unique_grouping": unique_grouping_list,
         "confusion_matrix": confusion_matrix_list,
         "f1_threshold_tuned": f1_threshold_tuned_list,
@@ -332,17 +503,20 @@ def collate_scores_binary_classification(scores_list):
 
 
 def scale_data(x_train, x_test, scaler_method=None):
+    # the features are used as C-contiguous float32 arrays
+    # (a no-op if they are already, as in kfold_cv)
+    x_train = np.ascontiguousarray(x_train, dtype=np.float32)
+    x_test = np.ascontiguousarray(x_test, dtype=np.float32)
+
     if scaler_method == "standard":
         print("scaling - standard")
         scaler = StandardScaler()
-        scaler.fit(x_train)
-        x_train = scaler.transform(x_train)
+        x_train = scaler.fit_transform(x_train)
         x_test = scaler.transform(x_test)
     elif scaler_method == "minmax":
         print("scaling - min/max")
         scaler = MinMaxScaler()
-        scaler.fit(x_train)
-        x_train = scaler.transform(x_train)
+        x_train = scaler.fit_transform(x_train)
         x_test = scaler.transform(x_test)
     else:
         print("no scaling")
@@ -376,40 +550,37 @@ def get_rates(tn, fp, fn, tp):
     return tpr, fpr, fnr, tnr
 
 
+def _min_max_avg_std(a):
+    """
+    Min, max, mean and standard deviation of an array of per-fold scores.
+    The std reuses the mean (rather than E[x^2] - E[x]^2) to avoid cancellation.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    avg = a.mean()
+    return a.min(), a.max(), avg, np.sqrt(np.mean(np.square(a - avg)))
+
+
 def get_model_metrics_df(model_metrics_dict):
 
-    selected_metrics_dict = {
-        "precision_score_min": np.min(model_metrics_dict["precision_score_array"]),
-        "precision_score_max": np.max(model_metrics_dict["precision_score_array"]),
-        "precision_score_avg": np.mean(model_metrics_dict["precision_score_array"]),
-        "precision_score_std": np.std(model_metrics_dict["precision_score_array"]),
-        "recall_score_min": np.min(model_metrics_dict["recall_score_array"]),
-        "recall_score_max": np.max(model_metrics_dict["recall_score_array"]),
-        "recall_score_avg": np.mean(model_metrics_dict["recall_score_array"]),
-        "recall_score_std": np.std(model_metrics_dict["recall_score_array"]),
-        "f1_score_min": np.min(model_metrics_dict["f1_score_array"]),
-        "f1_score_max": np.max(model_metrics_dict["f1_score_array"]),
-        "f1_score_avg": np.mean(model_metrics_dict["f1_score_array"]),
-        "f1_score_std": np.std(model_metrics_dict["f1_score_array"]),
-        "mcc_min": np.min(model_metrics_dict["mcc_array"]),
-        "mcc_max": np.max(model_metrics_dict["mcc_array"]),
-        "mcc_avg": np.mean(model_metrics_dict["mcc_array"]),
-        "mcc_std": np.std(model_metrics_dict["mcc_array"]),
-        "rocauc_min": np.min(model_metrics_dict["rocauc_array"]),
-        "rocauc_max": np.max(model_metrics_dict["rocauc_array"]),
-        "rocauc_avg": np.mean(model_metrics_dict["rocauc_array"]),
-        "rocauc_std": np.std(model_metrics_dict["rocauc_array"]),
-        "prauc_min": np.min(model_metrics_dict["prauc_array"]),
-        "prauc_max": np.max(model_metrics_dict["prauc_array"]),
-        "prauc_avg": np.mean(model_metrics_dict["prauc_array"]),
-        "prauc_std": np.std(model_metrics_dict["prauc_array"]),
-        "accuracy_min": np.min(model_metrics_dict["accuracy_array"]),
-        "accuracy_max": np.max(model_metrics_dict["accuracy_array"]),
-        "accuracy_avg": np.mean(model_metrics_dict["accuracy_array"]),
-        "accuracy_std": np.std(model_metrics_dict["accuracy_array"]),
-        "n_thresholds_min": np.min(model_metrics_dict["n_thresholds_array"]),
-        "n_thresholds_max": np.max(model_metrics_dict["n_thresholds_array"]),
-    }
+    selected_metrics_dict = {}
+    for name, array_key in [
+        ("precision_score", "precision_score_array"),
+        ("recall_score", "recall_score_array"),
+        ("f1_score", "f1_score_array"),
+        ("mcc", "mcc_array"),
+        ("rocauc", "rocauc_array"),
+        ("prauc", "prauc_array"),
+        ("accuracy", "accuracy_array"),
+    ]:
+        (
+            selected_metrics_dict[f"{name}_min"],
+            selected_metrics_dict[f"{name}_max"],
+            selected_metrics_dict[f"{name}_avg"],
+            selected_metrics_dict[f"{name}_std"],
+        ) = _min_max_avg_std(model_metrics_dict[array_key])
+
+    selected_metrics_dict["n_thresholds_min"] = np.min(model_metrics_dict["n_thresholds_array"])
+    selected_metrics_dict["n_thresholds_max"] = np.max(model_metrics_dict["n_thresholds_array"])
 
     # get argmin of prauc_array
     i_argmin = np.argmin(model_metrics_dict["prauc_array"])
@@ -453,10 +624,11 @@ def milling_add_y_label_anomaly(df_feat):
 
     """
     # set up the y label
-    df_feat["y"] = df_feat["tool_class"] > 1
-    df_feat["y"] = df_feat["y"].astype(int)
+    df_feat["y"] = (df_feat["tool_class"].to_numpy() > 1).astype(np.int8)
 
-    df_feat = df_feat.reset_index(drop=True)  # reset index just in case
+    # reset index just in case (not needed if it is already 0, 1, 2, ...)
+    if not df_feat.index.equals(pd.RangeIndex(len(df_feat))):
+        df_feat = df_feat.reset_index(drop=True)
 
     return df_feat
 
@@ -468,14 +640,18 @@ def cnc_add_y_label_binary(df, df_labels, col_list_case=None):
 
     df_labels["unix_date"] = df_labels["unix_date"].astype(int)
 
+    # the case columns are looked up by unix_date (one row per unix_date in the labels)
+    # and are added at the end. Rows with a unix_date that is not in the labels are dropped
+    rows = np.arange(len(df))
     if col_list_case is not None:
-        df = df.merge(df_labels[["unix_date"] + col_list_case], on=["unix_date"])
+        df_case = df_labels.set_index("unix_date")[col_list_case]
+        rows = np.flatnonzero(df["unix_date"].isin(df_case.index))
 
     # select all rows in df_labels where "failed_tools" is not empty
     df_labels = df_labels[df_labels["failed_tools"].notna()].copy()
 
     # convert each "failed_tools" string to a list
-    df_labels["failed_tools"] = df_labels["failed_tools"].apply(lambda x: x.split(" "))
+    df_labels["failed_tools"] = df_labels["failed_tools"].str.split(" ")
 
     df_labels = df_labels.explode("failed_tools")
 
@@ -484,23 +660,35 @@ def cnc_add_y_label_binary(df, df_labels, col_list_case=None):
     df_labels["failed"] = df_labels["failed"].astype(int)
 
     # drop any rows where "failed_tools" is not a numeric value
-    df_labels = df_labels[df_labels["failed_tools"].apply(lambda x: x.isnumeric())]
-    df_labels["failed_tools"] = df_labels["failed_tools"].astype(int)
-
-    df = pd.merge(
-        df,
-        df_labels[["unix_date", "failed", "failed_tools"]],
+    df_labels = df_labels[df_labels["failed_tools"].str.isnumeric()]
+    df_labels["failed_tools"] = df_labels["failed_tools"].astype(np.int64)
+
+    # merge only the join keys, as int64 on both sides, along with the row number in df
+    # the (wide) features in df are then copied once, when the merged rows are taken
+    df_keys = pd.merge(
+        pd.DataFrame(
+            {
+                "unix_date": df["unix_date"].to_numpy(dtype=np.int64)[rows],
+                "tool_no": df["tool_no"].to_numpy(dtype=np.int64)[rows],
+                "row": rows,
+            }
+        ),
+        df_labels.astype({"unix_date": np.int64}),
         left_on=["unix_date", "tool_no"],
         right_on=["unix_date", "failed_tools"],
         how="left",
-    ).drop(columns=["failed_tools"])
-    df["failed"] = df["failed"].fillna(0).astype(int)
-
-    df["y"] = df["failed"].astype(int)
-    df = df.drop(columns=["failed"])
+    )
+    y = df_keys["failed"].fillna(0).to_numpy().astype(int)
 
     # drop any rows where "y" is > 1
-    df = df[df["y"] <= 1]
+    # the index is the row number in the merged dataframe
+    keep = np.flatnonzero(y <= 1)
+    df = df.take(df_keys["row"].to_numpy()[keep])
+    df.index = keep
+    if col_list_case is not None:
+        for col in col_list_case:
+            df[col] = df["unix_date"].map(df_case[col])
+    df["y"] = y[keep]
 
     return df
 
@@ -149,7 +149,7 @@ def plot_pr_roc_curves_kfolds(
     precisions_all_segmented = np.array(precisions_all_segmented)
 
     for i, (p, r) in enumerate(zip(precision_array, recall_array)):
-        if i == np.shape(precision_array)[0] - 1:
+        if i == len(precision_array) - 1:
             axes[0].plot(
                 r[:],
                 p[:],
@@ -211,7 +211,7 @@ def plot_pr_roc_curves_kfolds(
     roc_all_segmented = np.array(roc_all_segmented)
 
     for i, (t, f) in enumerate(zip(tpr_array, fpr_array)):
-        if i == np.shape(tpr_array)[0] - 1:
+        if i == len(tpr_array) - 1:
             axes[1].plot(
                 f[:],
                 t[:],
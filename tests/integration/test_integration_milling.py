@@ -74,11 +74,13 @@ class TestMilling(unittest.TestCase):
 
         col_dtype_dict = dict(zip(col_names_ordered, col_dtype))
 
-        # load the ground truth results dataframe
+        # load the ground truth results dataframe, parsing the columns straight to their dtypes
         df_gt = pd.read_csv(
             self.results_path,
             compression="gzip",
-        ).astype(col_dtype_dict)
+            usecols=col_names_ordered,
+            dtype=col_dtype_dict,
+        )
 
         # compare the results
         assert_frame_equal(df, df_gt)